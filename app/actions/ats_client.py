@@ -1,59 +1,81 @@
 import logging
 import httpx
-import pydantic
-import xmltodict
-import stamina
+import msgspec
 
-from datetime import datetime, timedelta
-from xml.parsers.expat import ExpatError
-from typing import List, Optional
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pydantic.datetime_parse import parse_datetime
+from typing import Optional
+from lxml import etree
 
 
 logger = logging.getLogger(__name__)
 
 
-# Pydantic models
-class DataResponse(pydantic.BaseModel):
-    ats_serial_num: str = pydantic.Field(..., alias="AtsSerialNum")
-    longitude: float = pydantic.Field(None, alias='Longitude', ge=-180.0, le=360.0)
-    latitude: float = pydantic.Field(None, alias='Latitude', ge=-90.0, le=90.0)
-    date_year_and_julian: datetime = pydantic.Field(..., alias="DateYearAndJulian")
-    num_sats: Optional[str] = pydantic.Field(None, alias='NumSats')
-    hdop: Optional[str] = pydantic.Field(None, alias='Hdop')
-    fix_time: Optional[str] = pydantic.Field(None, alias='FixTime')
-    dimension: Optional[str] = pydantic.Field(None, alias='Dimension')
-    activity: Optional[str] = pydantic.Field(None, alias='Activity')
-    temperature: Optional[str] = pydantic.Field(None, alias='Temperature')
-    mortality: Optional[bool] = pydantic.Field(None, alias='Mortality')
-    low_batt_voltage: Optional[bool] = pydantic.Field(None, alias='LowBattVoltage')
+XML_PARSE_CHUNK_SIZE = 64 * 1024
+HTTP_STREAM_CHUNK_SIZE = 64 * 1024
 
-    class Config:
-        allow_population_by_field_name = True
+# Shared across pulls so back-to-back requests to the ATS host reuse pooled connections (closed on app shutdown)
+_http_client = httpx.AsyncClient(
+    timeout=120,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=50)
+)
 
 
-class TransmissionsResponse(pydantic.BaseModel):
-    date_sent: datetime = pydantic.Field(..., alias="DateSent")
-    collar_serial_num: str = pydantic.Field(..., alias="CollarSerialNum")
-    number_fixes: Optional[int] = pydantic.Field(None, alias='NumberFixes')
-    batt_voltage: Optional[float] = pydantic.Field(None, alias='BattVoltage')
-    mortality: Optional[str] = pydantic.Field(None, alias='Mortality')
-    break_off: Optional[str] = pydantic.Field(None, alias='BreakOff')
-    sat_errors: Optional[str] = pydantic.Field(None, alias='SatErrors')
-    year_base: Optional[str] = pydantic.Field(None, alias='YearBase')
-    day_base: Optional[str] = pydantic.Field(None, alias='DayBase')
-    gmt_offset: Optional[int] = pydantic.Field(None, alias='GmtOffset')
-    low_batt_voltage: Optional[bool] = pydantic.Field(None, alias='LowBattVoltage')
+# Data models (msgspec structs, fields are renamed to the ATS XML tags)
+class DataResponse(msgspec.Struct, kw_only=True, rename={
+    "ats_serial_num": "AtsSerialNum",
+    "longitude": "Longitude",
+    "latitude": "Latitude",
+    "date_year_and_julian": "DateYearAndJulian",
+    "num_sats": "NumSats",
+    "hdop": "Hdop",
+    "fix_time": "FixTime",
+    "dimension": "Dimension",
+    "activity": "Activity",
+    "temperature": "Temperature",
+    "mortality": "Mortality",
+    "low_batt_voltage": "LowBattVoltage",
+}):
+    ats_serial_num: str
+    longitude: Optional[float] = None  # -180.0 to 360.0, checked in _build_data_row
+    latitude: Optional[float] = None  # -90.0 to 90.0, checked in _build_data_row
+    date_year_and_julian: datetime
+    num_sats: Optional[str] = None
+    hdop: Optional[str] = None
+    fix_time: Optional[str] = None
+    dimension: Optional[str] = None
+    activity: Optional[str] = None
+    temperature: Optional[str] = None
+    mortality: Optional[bool] = None
+    low_batt_voltage: Optional[bool] = None
 
-    class Config:
-        allow_population_by_field_name = True
 
-
-class PullObservationsDataResponse(pydantic.BaseModel):
-    vehicles: List[DataResponse]
-
-
-class PullObservationsTransmissionsResponse(pydantic.BaseModel):
-    transmissions: List[TransmissionsResponse]
+class TransmissionsResponse(msgspec.Struct, kw_only=True, rename={
+    "date_sent": "DateSent",
+    "collar_serial_num": "CollarSerialNum",
+    "number_fixes": "NumberFixes",
+    "batt_voltage": "BattVoltage",
+    "mortality": "Mortality",
+    "break_off": "BreakOff",
+    "sat_errors": "SatErrors",
+    "year_base": "YearBase",
+    "day_base": "DayBase",
+    "gmt_offset": "GmtOffset",
+    "low_batt_voltage": "LowBattVoltage",
+}):
+    date_sent: datetime
+    collar_serial_num: str
+    number_fixes: Optional[int] = None
+    batt_voltage: Optional[float] = None
+    mortality: Optional[str] = None
+    break_off: Optional[str] = None
+    sat_errors: Optional[str] = None
+    year_base: Optional[str] = None
+    day_base: Optional[str] = None
+    gmt_offset: Optional[int] = None
+    low_batt_voltage: Optional[bool] = None
 
 
 class ATSBadXMLException(Exception):
@@ -64,114 +86,196 @@ class ATSBadXMLException(Exception):
         super().__init__(f"'{self.status_code}: {self.message}, Error: {self.error}'")
 
 
-def closest_transmission(transmissions, test_date):
-    sorted_list = sorted([t.DateSent for t in transmissions])
-    previous_date = sorted_list[-1]
-    for date in sorted_list:
-        if date >= test_date:
-            if abs((date - test_date).days) < abs((previous_date - test_date).days):
-                return [t for t in transmissions if t.DateSent == date][0]
+_BOOL_TRUE = {"1", "on", "t", "true", "y", "yes"}
+_BOOL_FALSE = {"0", "off", "f", "false", "n", "no"}
+
+
+def _parse_bool(value):
+    # Same accepted values as pydantic's bool validator
+    lowered = value.strip().lower()
+    if lowered in _BOOL_TRUE:
+        return True
+    if lowered in _BOOL_FALSE:
+        return False
+    raise ValueError(f"Invalid boolean value: '{value}'")
+
+
+def _bounded_float(ge, le):
+    def parse(value):
+        number = float(value)
+        if not ge <= number <= le:
+            raise ValueError(f"Value {number} out of range [{ge}, {le}]")
+        return number
+    return parse
+
+
+def _required(d, alias):
+    # Empty XML elements come in as None, they are treated as missing for required fields
+    if (value := d.get(alias)) is None:
+        raise ValueError(f"Missing required field: '{alias}'")
+    return value
+
+
+def _make_row_builder(struct_cls, coercers):
+    """
+    Generates a function that builds a struct instance from a flat XML row dict.
+    The XML schema from ATS is fixed, so the coercions are written into a single constructor call (no validation).
+    :param struct_cls: The msgspec struct to build, its fields are renamed to the XML tags
+    :param coercers: Maps XML tags to the callable used to convert its text (others are passed as is)
+    """
+    namespace = {"_struct_cls": struct_cls, "_required": _required}
+    kwargs = []
+    for field in msgspec.structs.fields(struct_cls):
+        alias = field.encode_name
+        value = f'_required(d, "{alias}")' if field.required else f'd.get("{alias}")'
+        if alias in coercers:
+            namespace[f"_coerce_{alias}"] = coercers[alias]
+            if field.required:
+                value = f"_coerce_{alias}({value})"
             else:
-                return [t for t in transmissions if t.DateSent == previous_date][0]
-        previous_date = date
-    return [t for t in transmissions if t.DateSent == sorted_list[-1]][0]
+                value = f"(None if (v := {value}) is None else _coerce_{alias}(v))"
+        kwargs.append(f"{field.name}={value}")
+    source = f"def build_row(d):\n    return _struct_cls({', '.join(kwargs)})\n"
+    exec(source, namespace)
+    return namespace["build_row"]
+
+
+_build_data_row = _make_row_builder(
+    DataResponse,
+    coercers={
+        "AtsSerialNum": str,
+        "Longitude": _bounded_float(ge=-180.0, le=360.0),
+        "Latitude": _bounded_float(ge=-90.0, le=90.0),
+        "DateYearAndJulian": parse_datetime,
+        "Mortality": _parse_bool,
+        "LowBattVoltage": _parse_bool,
+    }
+)
+
+
+_build_transmission_row = _make_row_builder(
+    TransmissionsResponse,
+    coercers={
+        "DateSent": parse_datetime,
+        "CollarSerialNum": str,
+        "NumberFixes": int,
+        "BattVoltage": float,
+        "GmtOffset": int,
+        "LowBattVoltage": _parse_bool,
+    }
+)
+
+
+def closest_transmission(transmissions, test_date):
+    # Single pass, ties are resolved in favor of the earlier transmission
+    return min(transmissions, key=lambda t: (abs(t.date_sent - test_date), t.date_sent))
+
+
+def _strip_text(text):
+    # Same as xmltodict: surrounding whitespace is stripped and whitespace-only elements are None
+    return (text.strip() or None) if text else None
+
+
+_DATA_ROW_PATH = ("NewDataSet", "diffgram", "DataSet")
 
 
-def parse_data_points_from_xml(xml):
-    result = {}
+def _is_data_row(elem):
+    # Only rows under DataSet/diffgr:diffgram/NewDataSet are data (i.e. not the ones in diffgr:before)
+    parent = elem.getparent()
+    for localname in _DATA_ROW_PATH:
+        if parent is None or etree.QName(parent).localname != localname:
+            return False
+        parent = parent.getparent()
+    return parent is None
+
+
+async def _iter_chunks(xml):
+    # In-memory documents are fed at once, anything else is an async iterable of byte chunks (e.g. a file being read)
+    if isinstance(xml, (str, bytes)):
+        yield xml.encode("utf-8") if isinstance(xml, str) else xml
+    else:
+        async for chunk in xml:
+            yield chunk
+
+
+async def _iter_tables(xml):
+    logger.info(f"-- Parsing XML (lxml) --")
+    # Stream the XML through libxml2 and yield one <Table> row at a time as a flat dict
+    parser = etree.XMLPullParser(events=("end",), tag="{*}Table", resolve_entities=False, no_network=True)
     try:
-        logger.info(f"-- Parsing response (xmltodict) --")
-        parsed_xml = xmltodict.parse(xml)
-    except (xmltodict.ParsingInterrupted, ExpatError) as e:
+        async for chunk in _iter_chunks(xml):
+            parser.feed(chunk)
+            for _, elem in parser.read_events():
+                if _is_data_row(elem):
+                    yield {
+                        etree.QName(child).localname: _strip_text(child.text)
+                        for child in elem if isinstance(child.tag, str)
+                    }
+                # Free the processed rows so the tree doesn't grow with the document
+                elem.clear(keep_tail=True)
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        root = parser.close()
+    except etree.XMLSyntaxError as e:
         msg = f"Invalid XML."
         logger.exception(msg)
         raise ATSBadXMLException(message=msg, error=e)
 
-    try:
-        data_xml_tag = parsed_xml["DataSet"].get("diffgr:diffgram", {})
-        data = data_xml_tag.get("NewDataSet", {})
-    except KeyError as e:
+    if etree.QName(root).localname != "DataSet":
         msg = f"Dataset or NewDataSet tag not found in XML."
+        logger.error(msg)
+        raise ATSBadXMLException(message=msg, error=KeyError("DataSet"))
+
+
+async def parse_data_points_from_xml(xml):
+    try:
+        vehicles = [_build_data_row(row) async for row in _iter_tables(xml)]
+    except (KeyError, TypeError, ValueError) as e:
+        msg = f"Error building 'DataResponse'."
         logger.exception(msg)
         raise ATSBadXMLException(message=msg, error=e)
 
-    if data:
-        try:
-            parsed_response = PullObservationsDataResponse.parse_obj(
-                {"vehicles": data.get("Table", [])}
-            )
-        except pydantic.ValidationError as e:
-            msg = f"Error building 'PullObservationsTransmissionsResponse'."
-            logger.exception(msg)
-            raise ATSBadXMLException(message=msg, error=e)
-
-        response_per_device = {}
-        # save data points per serial num
-        serial_nums = set([v.ats_serial_num for v in parsed_response.vehicles])
-        for serial_num in serial_nums:
-            response_per_device[serial_num] = [
-                point for point in parsed_response.vehicles if serial_num == point.ats_serial_num
-            ]
-            logger.info(
-                f"-- Extracted {len(response_per_device[serial_num])} data points for device {serial_num} --")
-        result = response_per_device
-
-    return result
-
-
-@stamina.retry(on=httpx.HTTPError, wait_initial=4.0, wait_jitter=5.0, wait_max=32.0)
-async def get_data_endpoint_response(integration_id, config, auth, parse_response=False):
-    endpoint = config.data_endpoint
-    async with httpx.AsyncClient(timeout=120) as session:
-        logger.info(f"-- Getting data points for integration ID: {integration_id} Endpoint: {endpoint} --")
-        response = await session.get(endpoint, auth=(auth.username, auth.password.get_secret_value()))
+    # save data points per serial num
+    response_per_device = defaultdict(list)
+    for v in vehicles:
+        response_per_device[v.ats_serial_num].append(v)
+    for serial_num, points in response_per_device.items():
+        logger.info(f"-- Extracted {len(points)} data points for device {serial_num} --")
+
+    return dict(response_per_device)
+
+
+@asynccontextmanager
+async def _stream_endpoint_response(endpoint, auth):
+    auth_credentials = (auth.username, auth.password.get_secret_value())
+    async with _http_client.stream("GET", endpoint, auth=auth_credentials) as response:
         response.raise_for_status()
-        if parse_response:
-            return parse_data_points_from_xml(xml=response.text)
-        else:
-            return response.text
+        yield response
 
 
-def parse_transmissions_from_xml(xml):
-    result = {}
-    try:
-        logger.info(f"-- Parsing transmissions XML (xmltodict) --")
-        parsed_xml = xmltodict.parse(xml)
-    except (xmltodict.ParsingInterrupted, ExpatError) as e:
-        msg = f"Invalid XML."
-        logger.exception(msg)
-        raise ATSBadXMLException(message=msg, error=e)
+async def close():
+    # Releases the pooled connections, meant to be called on service shutdown
+    await _http_client.aclose()
+
 
+def get_data_endpoint_response(integration_id, config, auth):
+    # Returns a context manager with the streamed response, so the body can be consumed in chunks
+    endpoint = config.data_endpoint
+    logger.info(f"-- Getting data points for integration ID: {integration_id} Endpoint: {endpoint} --")
+    return _stream_endpoint_response(endpoint=endpoint, auth=auth)
+
+
+async def parse_transmissions_from_xml(xml):
     try:
-        transmissions_xml_tag = parsed_xml["DataSet"].get("diffgr:diffgram", {})
-        transmissions = transmissions_xml_tag.get("NewDataSet", {})
-    except KeyError as e:
-        msg = f"Dataset or NewDataSet tag not found in XML."
+        return [_build_transmission_row(row) async for row in _iter_tables(xml)]
+    except (KeyError, TypeError, ValueError) as e:
+        msg = f"Error building 'TransmissionsResponse'."
         logger.exception(msg)
         raise ATSBadXMLException(message=msg, error=e)
 
-    if transmissions:
-        try:
-            parsed_response = PullObservationsTransmissionsResponse.parse_obj(
-                {"transmissions": transmissions.get("Table", [])}
-            )
-        except pydantic.ValidationError as e:
-            msg = f"Error building 'PullObservationsTransmissionsResponse'."
-            logger.exception(msg)
-            raise ATSBadXMLException(message=msg, error=e)
-        else:
-            result = parsed_response.transmissions
-    return result
-
-
-@stamina.retry(on=httpx.HTTPError, wait_initial=4.0, wait_jitter=5.0, wait_max=32.0)
-async def get_transmissions_endpoint_response(integration_id, config, auth, parse_response=False):
+
+def get_transmissions_endpoint_response(integration_id, config, auth):
+    # Returns a context manager with the streamed response, so the body can be consumed in chunks
     endpoint = config.transmissions_endpoint
-    async with httpx.AsyncClient(timeout=120) as session:
-        logger.info(f"-- Getting transmissions for integration ID: {integration_id} Endpoint: {endpoint} --")
-        response = await session.get(endpoint, auth=(auth.username, auth.password.get_secret_value()))
-        response.raise_for_status()
-        if parse_response:
-            return parse_transmissions_from_xml(xml=response.text)
-        else:
-            return response.text
+    logger.info(f"-- Getting transmissions for integration ID: {integration_id} Endpoint: {endpoint} --")
+    return _stream_endpoint_response(endpoint=endpoint, auth=auth)
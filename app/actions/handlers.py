@@ -1,7 +1,11 @@
 import asyncio
 import datetime
 import aiohttp
+import functools
+import httpx
+import itertools
 import logging
+import stamina
 import aiofiles
 from gundi_core.schemas.v2.gundi import LogLevel
 from app import settings
@@ -32,6 +36,10 @@ PENDING_FILES = "ats_pending_files"
 IN_PROGRESS_FILES = "ats_in_progress_files"
 PROCESSED_FILES = "ats_processed_files"
 
+MAIN_DATA_FIELDS = ("ats_serial_num", "date_year_and_julian", "latitude", "longitude")
+# Data point fields sent as "additional" observation data
+ADDITIONAL_DATA_FIELDS = tuple(f for f in ats_client.DataResponse.__struct_fields__ if f not in MAIN_DATA_FIELDS)
+
 
 def extract_gmt_offsets(transmissions, integration_id):
     offsets_by_device = {}
@@ -68,9 +76,14 @@ async def get_file_status(file_name):
     return {}
 
 
+@functools.lru_cache(maxsize=None)
+def get_timezone(gmt_offset):
+    # Only a few dozen distinct offsets exist, so the tzinfo objects are reused across devices and runs
+    return datetime.timezone(datetime.timedelta(hours=gmt_offset))
+
+
 async def filter_and_transform(serial_num, vehicles, gmt_offset, integration_id, action_id):
     transformed_data = []
-    main_data = ["ats_serial_num", "date_year_and_julian", "latitude", "longitude"]
 
     # check and log invalid GMT offset
     if abs(gmt_offset) > 24:
@@ -84,27 +97,25 @@ async def filter_and_transform(serial_num, vehicles, gmt_offset, integration_id,
         )
         gmt_offset = 0
 
-    for vehicle in vehicles:
-        # Get GmtOffset for this device
-        time_delta = datetime.timedelta(hours=gmt_offset)
-        timezone_object = datetime.timezone(time_delta)
-
-        date_year_and_julian_with_tz = vehicle.date_year_and_julian.replace(tzinfo=timezone_object)
-
-        vehicle.date_year_and_julian = date_year_and_julian_with_tz
+    # Same GmtOffset for all the points of this device (UTC is the most common case)
+    timezone_object = get_timezone(int(gmt_offset)) if gmt_offset else datetime.timezone.utc
 
+    for vehicle in vehicles:
+        recorded_at = vehicle.date_year_and_julian
+        if recorded_at.tzinfo is not timezone_object:
+            recorded_at = recorded_at.replace(tzinfo=timezone_object)
         data = {
             "source": vehicle.ats_serial_num,
             "source_name": vehicle.ats_serial_num,
             'type': 'tracking-device',
-            "recorded_at": vehicle.date_year_and_julian,
+            "recorded_at": recorded_at,
             "location": {
                 "lat": vehicle.latitude,
                 "lon": vehicle.longitude
             },
             "additional": {
-                key: value for key, value in vehicle.dict().items()
-                if key not in main_data and value is not None
+                key: value for key in ADDITIONAL_DATA_FIELDS
+                if (value := getattr(vehicle, key)) is not None
             }
         }
         transformed_data.append(data)
@@ -112,30 +123,64 @@ async def filter_and_transform(serial_num, vehicles, gmt_offset, integration_id,
     return transformed_data
 
 
+def generate_batches(iterable, n):
+    # Works with any iterable, not only lists
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, n)):
+        yield batch
+
+
+async def read_in_chunks(file, chunk_size):
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+async def gather_or_cancel(*aws):
+    # Like asyncio.gather, but the remaining tasks are cancelled (and awaited) as soon as one of them fails
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def send_observations_batch(batch, batch_number, serial_num, integration_id, semaphore):
+    async with semaphore:
+        logger.info(
+            f'Sending observations batch #{batch_number}: {len(batch)} observations. Device: {serial_num}'
+        )
+        await gundi_tools.send_observations_to_gundi(
+            observations=batch,
+            integration_id=integration_id
+        )
+    return len(batch)
+
+
 async def retrieve_transmissions(integration_id, auth_config, pull_config, file_prefix):
     logger.info(f"Retrieving transmissions for integration '{integration_id}'...")
-    transmissions_raw_xml = await ats_client.get_transmissions_endpoint_response(
-        integration_id=integration_id,
-        config=pull_config,
-        auth=auth_config
-    )
-
     transmissions_file_name = f"{file_prefix}_transmissions.xml"
-    logger.info(f"Saving transmissions for integration '{integration_id}' to file '{transmissions_file_name}'...")
-    async with aiofiles.open(f"/tmp/{transmissions_file_name}", "w") as f:
-        await f.write(transmissions_raw_xml)
-
-    logger.info(f"Uploading transmissions file {transmissions_file_name} to cloud storage...")
-    await file_storage.upload_file(
-        integration_id=integration_id,
-        local_file_path=f"/tmp/{transmissions_file_name}",
-        destination_blob_name=transmissions_file_name,
-        metadata={
-            "integration_id": integration_id,
-            "ats_username": auth_config.username,
-            "status": FileStatus.PENDING.value
-        }
-    )
+    async for attempt in stamina.retry_context(on=httpx.HTTPError, wait_initial=4.0, wait_jitter=5.0, wait_max=32.0):
+        with attempt:
+            async with ats_client.get_transmissions_endpoint_response(
+                integration_id=integration_id,
+                config=pull_config,
+                auth=auth_config
+            ) as response:
+                # Pipe the response body straight to cloud storage
+                logger.info(f"Uploading transmissions file {transmissions_file_name} to cloud storage...")
+                await file_storage.upload_stream(
+                    integration_id=integration_id,
+                    destination_blob_name=transmissions_file_name,
+                    chunks=response.aiter_bytes(ats_client.HTTP_STREAM_CHUNK_SIZE),
+                    metadata={
+                        "integration_id": integration_id,
+                        "ats_username": auth_config.username,
+                        "status": FileStatus.PENDING.value
+                    }
+                )
 
     logger.info(f"Transmissions file {transmissions_file_name} saved.")
     return transmissions_file_name
@@ -143,34 +188,27 @@ async def retrieve_transmissions(integration_id, auth_config, pull_config, file_
 
 async def retrieve_data_points(integration_id, auth_config, pull_config, file_prefix):
     logger.info(f"Retrieving data points for integration '{integration_id}'...")
-    data_points_raw_xml = await ats_client.get_data_endpoint_response(
-        integration_id=integration_id,
-        config=pull_config,
-        auth=auth_config
-    )
-
     data_points_file_name = f"{file_prefix}_data_points.xml"
-    logger.info(f"Saving data points for integration '{integration_id}' to file '{data_points_file_name}'...")
-    async with aiofiles.open(f"/tmp/{data_points_file_name}", "w") as f:
-        await f.write(data_points_raw_xml)
-
-    logger.info(f"Uploading data points file {data_points_file_name} to cloud storage...")
-    await file_storage.upload_file(
-        integration_id=integration_id,
-        local_file_path=f"/tmp/{data_points_file_name}",
-        destination_blob_name=data_points_file_name,
-        metadata={
-            "integration_id": integration_id,
-            "ats_username": auth_config.username,
-            "status": FileStatus.PENDING.value
-        }
-    )
+    async for attempt in stamina.retry_context(on=httpx.HTTPError, wait_initial=4.0, wait_jitter=5.0, wait_max=32.0):
+        with attempt:
+            async with ats_client.get_data_endpoint_response(
+                integration_id=integration_id,
+                config=pull_config,
+                auth=auth_config
+            ) as response:
+                # Pipe the response body straight to cloud storage
+                logger.info(f"Uploading data points file {data_points_file_name} to cloud storage...")
+                await file_storage.upload_stream(
+                    integration_id=integration_id,
+                    destination_blob_name=data_points_file_name,
+                    chunks=response.aiter_bytes(ats_client.HTTP_STREAM_CHUNK_SIZE),
+                    metadata={
+                        "integration_id": integration_id,
+                        "ats_username": auth_config.username,
+                        "status": FileStatus.PENDING.value
+                    }
+                )
 
-    # Add it to the list of pending files to be processed
-    await state_manager.group_add(
-        group_name=PENDING_FILES,
-        values=[data_points_file_name]
-    )
     logger.info(f"Data points file {data_points_file_name} saved.")
     return data_points_file_name
 
@@ -186,17 +224,25 @@ async def action_pull_observations(integration, action_config: PullObservationsC
     pull_config = action_config
     timestamp = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y%m%d%H%M%S%f")
     file_prefix = f"{timestamp}_{integration_id}"
-    transmissions_file = await retrieve_transmissions(
-        integration_id=integration_id,
-        auth_config=auth_config,
-        pull_config=pull_config,
-        file_prefix=file_prefix
+    # Both endpoints are independent, so fetch and upload them concurrently
+    transmissions_file, data_points_file = await gather_or_cancel(
+        retrieve_transmissions(
+            integration_id=integration_id,
+            auth_config=auth_config,
+            pull_config=pull_config,
+            file_prefix=file_prefix
+        ),
+        retrieve_data_points(
+            integration_id=integration_id,
+            auth_config=auth_config,
+            pull_config=pull_config,
+            file_prefix=file_prefix
+        )
     )
-    data_points_file = await retrieve_data_points(
-        integration_id=integration_id,
-        auth_config=auth_config,
-        pull_config=pull_config,
-        file_prefix=file_prefix
+    # Add the data file to the list of pending files only once both files are saved
+    await state_manager.group_add(
+        group_name=PENDING_FILES,
+        values=[data_points_file]
     )
     logger.info(f"-- Observations pulled with success for integration ID: {str(integration.id)}.")
 
@@ -217,7 +263,6 @@ async def process_data_file(file_name, integration, process_config):
 
     transmissions = {}
     data_points_per_device = {}
-    observations_processed = 0
     integration_id = str(integration.id)
 
     logger.info(f"Downloading data file {file_name} from cloud storage...")
@@ -251,10 +296,11 @@ async def process_data_file(file_name, integration, process_config):
     logger.info(f"Transmissions file {transmissions_file_name} downloaded.")
 
     # Try to parse the transmissions file to get tz offsets
-    async with aiofiles.open(local_transmissions_file_path, "r") as f:
-        transmissions_xml_content = await f.read()
+    async with aiofiles.open(local_transmissions_file_path, "rb") as f:
         try:
-            transmissions = ats_client.parse_transmissions_from_xml(xml=transmissions_xml_content)
+            transmissions = await ats_client.parse_transmissions_from_xml(
+                xml=read_in_chunks(f, ats_client.XML_PARSE_CHUNK_SIZE)
+            )
         except Exception as e:
             msg = f"Error parsing '{transmissions_file_name}': {e}. Integration ID: {integration_id}."
             logger.exception(msg)
@@ -270,10 +316,12 @@ async def process_data_file(file_name, integration, process_config):
     logger.info(f"-- Integration ID: {str(integration.id)}, GMT offsets: {gmt_offsets} --")
 
     logger.info(f"Processing data points from file {file_name}...")
-    async with aiofiles.open(local_data_file_path, "r") as f:
-        data_points_xml_content = await f.read()
+    async with aiofiles.open(local_data_file_path, "rb") as f:
         try:
-            data_points_per_device = ats_client.parse_data_points_from_xml(xml=data_points_xml_content)
+            # The file is parsed as it's read, so the whole document is never held in memory
+            data_points_per_device = await ats_client.parse_data_points_from_xml(
+                xml=read_in_chunks(f, ats_client.XML_PARSE_CHUNK_SIZE)
+            )
         except Exception as e:
             msg = f"Error parsing '{file_name}': {e}. Integration ID: {integration_id}."
             logger.exception(msg)
@@ -289,6 +337,7 @@ async def process_data_file(file_name, integration, process_config):
         msg = f"No data points were extracted from '{file_name}'. Integration ID: {integration_id}."
         logger.warning(msg)
 
+    batches = []
     for serial_num, data_points in data_points_per_device.items():
         logger.info(f"Processing data points for device {serial_num}, integration {integration_id}...")
         transformed_data = await filter_and_transform(
@@ -300,24 +349,30 @@ async def process_data_file(file_name, integration, process_config):
         )
 
         if transformed_data:
-            # Send transformed data to Sensors API V2
-            def generate_batches(iterable, n=settings.OBSERVATIONS_BATCH_SIZE):
-                for i in range(0, len(iterable), n):
-                    yield iterable[i: i + n]
-
-            for i, batch in enumerate(generate_batches(transformed_data)):
-                logger.info(
-                    f'Sending observations batch #{i}: {len(batch)} observations. Device: {serial_num}'
-                )
-                await gundi_tools.send_observations_to_gundi(
-                    observations=batch,
-                    integration_id=integration.id
-                )
-                observations_processed += len(batch)
+            for i, batch in enumerate(generate_batches(transformed_data, settings.OBSERVATIONS_BATCH_SIZE)):
+                batches.append((serial_num, i, batch))
         else:
             message = f"No observations after transformation for device {serial_num}, integration {integration_id}."
             logger.warning(message)
 
+    # Send transformed data to Sensors API V2
+    # Batches are independent, so up to MAX_CONCURRENT_OBSERVATION_BATCHES are sent at the same time
+    # and the rest are cancelled if one of them fails
+    send_semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_OBSERVATION_BATCHES)
+    sent_batches = await gather_or_cancel(
+        *(
+            send_observations_batch(
+                batch=batch,
+                batch_number=i,
+                serial_num=serial_num,
+                integration_id=integration.id,
+                semaphore=send_semaphore
+            )
+            for serial_num, i, batch in batches
+        )
+    )
+    observations_processed = sum(sent_batches)
+
     # Set the file status as processed
     await state_manager.group_move(
         from_group=IN_PROGRESS_FILES,
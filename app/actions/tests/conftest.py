@@ -2,7 +2,7 @@ import asyncio
 import pytest
 import datetime
 
-import xmltodict
+from lxml import etree
 from gundi_core.schemas.v2 import Integration
 
 from app.actions.ats_client import TransmissionsResponse, DataResponse, ATSBadXMLException
@@ -14,6 +14,19 @@ def async_return(result):
     return f
 
 
+async def async_iter(items):
+    for item in items:
+        yield item
+
+
+def mock_streamed_response(mocker, content):
+    mock_response = mocker.MagicMock()
+    mock_response.aiter_bytes.return_value = async_iter([content.encode("utf-8")])
+    mock_response_context = mocker.MagicMock()
+    mock_response_context.__aenter__.return_value = mock_response
+    return mock_response_context
+
+
 @pytest.fixture
 def ats_integration_v2():
     return Integration.parse_obj(
@@ -104,6 +117,7 @@ def mock_state_manager(mocker, mock_transmissions_file_name, mock_data_file_name
 def mock_file_storage(mocker):
     mock_file_storage = mocker.MagicMock()
     mock_file_storage.upload_file.return_value = async_return(None)
+    mock_file_storage.upload_stream.return_value = async_return(None)
     mock_file_storage.download_file.return_value = async_return(None)
     mock_file_storage.delete_file.return_value = async_return(None)
     mock_file_storage.update_file_metadata.return_value = async_return(None)
@@ -275,7 +289,7 @@ def mock_aiofiles(
     mock_client = mocker.MagicMock()
     mock_fd = mocker.MagicMock()
     mock_fd.__aenter__.return_value = mock_fd
-    mock_fd.read.return_value = async_return(mock_ats_transmissions_response_xml)
+    mock_fd.read.return_value = async_return(mock_ats_transmissions_response_xml.encode("utf-8"))
     mock_client.open.return_value = mock_fd
     return mock_client
 
@@ -290,10 +304,10 @@ def mock_ats_client(
 
 ):
     ats_client_mock = mocker.MagicMock()
-    ats_client_mock.get_data_endpoint_response.return_value = async_return(mock_ats_data_response_xml)
-    ats_client_mock.get_transmissions_endpoint_response.return_value = async_return(mock_ats_transmissions_response_xml)
-    ats_client_mock.parse_data_points_from_xml.return_value = mock_ats_data_parsed
-    ats_client_mock.parse_transmissions_from_xml.return_value = mock_ats_transmissions_parsed
+    ats_client_mock.get_data_endpoint_response.return_value = mock_streamed_response(mocker, mock_ats_data_response_xml)
+    ats_client_mock.get_transmissions_endpoint_response.return_value = mock_streamed_response(mocker, mock_ats_transmissions_response_xml)
+    ats_client_mock.parse_data_points_from_xml.return_value = async_return(mock_ats_data_parsed)
+    ats_client_mock.parse_transmissions_from_xml.return_value = async_return(mock_ats_transmissions_parsed)
     return ats_client_mock
 
 
@@ -307,10 +321,12 @@ def mock_ats_client_with_invalid_tz_offsets(
 
 ):
     ats_client_mock = mocker.MagicMock()
-    ats_client_mock.get_data_endpoint_response.return_value = async_return(mock_ats_data_response_xml)
-    ats_client_mock.get_transmissions_endpoint_response.return_value = async_return(mock_ats_transmissions_response_with_invalid_offsets)
-    ats_client_mock.parse_data_points_from_xml.return_value = mock_ats_data_parsed
-    ats_client_mock.parse_transmissions_from_xml.return_value = mock_ats_transmissions_with_invalid_offsets_parsed
+    ats_client_mock.get_data_endpoint_response.return_value = mock_streamed_response(mocker, mock_ats_data_response_xml)
+    ats_client_mock.get_transmissions_endpoint_response.return_value = mock_streamed_response(mocker, mock_ats_transmissions_response_with_invalid_offsets)
+    ats_client_mock.parse_data_points_from_xml.return_value = async_return(mock_ats_data_parsed)
+    ats_client_mock.parse_transmissions_from_xml.return_value = async_return(
+        mock_ats_transmissions_with_invalid_offsets_parsed
+    )
     return ats_client_mock
 
 
@@ -324,12 +340,12 @@ def mock_ats_client_with_parse_error(
 
 ):
     ats_client_mock = mocker.MagicMock()
-    ats_client_mock.get_data_endpoint_response.return_value = async_return(mock_ats_data_response_xml)
-    ats_client_mock.get_transmissions_endpoint_response.return_value = async_return(mock_ats_transmissions_response_xml)
+    ats_client_mock.get_data_endpoint_response.return_value = mock_streamed_response(mocker, mock_ats_data_response_xml)
+    ats_client_mock.get_transmissions_endpoint_response.return_value = mock_streamed_response(mocker, mock_ats_transmissions_response_xml)
     ats_client_mock.parse_data_points_from_xml.side_effect = (
-        ATSBadXMLException(message="Invalid XML.",  error=xmltodict.ParsingInterrupted()),
+        ATSBadXMLException(message="Invalid XML.",  error=etree.XMLSyntaxError("Premature end of data", None, 1, 1)),
     )
-    ats_client_mock.parse_transmissions_from_xml.return_value = mock_ats_transmissions_parsed
+    ats_client_mock.parse_transmissions_from_xml.return_value = async_return(mock_ats_transmissions_parsed)
     return ats_client_mock
 
 
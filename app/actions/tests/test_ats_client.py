@@ -1,3 +1,4 @@
+import datetime
 import httpx
 import pytest
 import respx
@@ -8,8 +9,10 @@ from ..ats_client import (
     parse_data_points_from_xml,
     parse_transmissions_from_xml,
     ATSBadXMLException,
+    closest_transmission,
 )
 from ..configurations import PullObservationsConfig, AuthenticateConfig
+from .conftest import async_iter
 
 
 @pytest.mark.asyncio
@@ -28,29 +31,32 @@ async def test_get_transmissions_endpoint_response(ats_integration_v2, mock_ats_
             status_code=httpx.codes.OK,
             text=mock_ats_transmissions_response_xml
         )
-        response = await get_transmissions_endpoint_response(
+        async with get_transmissions_endpoint_response(
             integration_id=str(ats_integration_v2.id),
             config=pull_config,
             auth=auth_config,
-            parse_response=False,
-        )
-        assert response == mock_ats_transmissions_response_xml
+        ) as response:
+            content = b"".join([chunk async for chunk in response.aiter_bytes()])
+        assert content.decode("utf-8") == mock_ats_transmissions_response_xml
 
 
-def test_parse_transmissions_from_xml(mock_ats_transmissions_response_xml, mock_ats_transmissions_parsed):
-    result = parse_transmissions_from_xml(mock_ats_transmissions_response_xml)
+@pytest.mark.asyncio
+async def test_parse_transmissions_from_xml(mock_ats_transmissions_response_xml, mock_ats_transmissions_parsed):
+    result = await parse_transmissions_from_xml(mock_ats_transmissions_response_xml)
     assert result == mock_ats_transmissions_parsed
 
 
-def test_parse_transmissions_from_xml_with_invalid_offset(
+@pytest.mark.asyncio
+async def test_parse_transmissions_from_xml_with_invalid_offset(
         mock_ats_transmissions_response_with_invalid_offsets, mock_ats_transmissions_with_invalid_offsets_parsed
 ):
-    result = parse_transmissions_from_xml(mock_ats_transmissions_response_with_invalid_offsets)
+    result = await parse_transmissions_from_xml(mock_ats_transmissions_response_with_invalid_offsets)
     assert result == mock_ats_transmissions_with_invalid_offsets_parsed  # Invalid offsets are accepted and fixed later
 
 
-def test_parse_transmissions_from_empty_xml(mock_ats_transmissions_response_empty_xml):
-    result = parse_data_points_from_xml(mock_ats_transmissions_response_empty_xml)
+@pytest.mark.asyncio
+async def test_parse_transmissions_from_empty_xml(mock_ats_transmissions_response_empty_xml):
+    result = await parse_data_points_from_xml(mock_ats_transmissions_response_empty_xml)
     assert result == {}
 
 
@@ -70,25 +76,127 @@ async def test_get_data_endpoint_response(ats_integration_v2, mock_ats_data_resp
             status_code=httpx.codes.OK,
             text=mock_ats_data_response_xml
         )
-        response = await get_data_endpoint_response(
+        async with get_data_endpoint_response(
             integration_id=str(ats_integration_v2.id),
             config=pull_config,
             auth=auth_config,
-            parse_response=False,
-        )
-        assert response == mock_ats_data_response_xml
+        ) as response:
+            content = b"".join([chunk async for chunk in response.aiter_bytes()])
+        assert content.decode("utf-8") == mock_ats_data_response_xml
+
+
+@pytest.mark.asyncio
+async def test_parse_data_points_from_xml(mock_ats_data_response_xml, mock_ats_data_parsed):
+    result = await parse_data_points_from_xml(mock_ats_data_response_xml)
+    assert result == mock_ats_data_parsed
 
 
-def test_parse_data_points_from_xml(mock_ats_data_response_xml, mock_ats_data_parsed):
-    result = parse_data_points_from_xml(mock_ats_data_response_xml)
+@pytest.mark.asyncio
+async def test_parse_data_points_from_xml_bytes(mock_ats_data_response_xml, mock_ats_data_parsed):
+    result = await parse_data_points_from_xml(mock_ats_data_response_xml.encode("utf-8"))
+    assert result == mock_ats_data_parsed
+
+
+@pytest.mark.asyncio
+async def test_parse_data_points_from_xml_chunks(mock_ats_data_response_xml, mock_ats_data_parsed):
+    data = mock_ats_data_response_xml.encode("utf-8")
+    chunks = [data[i: i + 100] for i in range(0, len(data), 100)]
+    result = await parse_data_points_from_xml(async_iter(chunks))
     assert result == mock_ats_data_parsed
 
 
-def test_parse_data_points_raises_on_invalid_xml(mock_ats_data_response_with_invalid_xml):
+@pytest.mark.asyncio
+async def test_parse_data_points_raises_on_invalid_xml(mock_ats_data_response_with_invalid_xml):
     with pytest.raises(ATSBadXMLException):
-        parse_data_points_from_xml(mock_ats_data_response_with_invalid_xml)
+        await parse_data_points_from_xml(mock_ats_data_response_with_invalid_xml)
 
 
-def test_parse_data_points_from_empty_xml(mock_ats_data_response_no_points_xml):
-    result = parse_data_points_from_xml(mock_ats_data_response_no_points_xml)
+@pytest.mark.asyncio
+async def test_parse_data_points_from_empty_xml(mock_ats_data_response_no_points_xml):
+    result = await parse_data_points_from_xml(mock_ats_data_response_no_points_xml)
     assert result == {}
+
+
+def _data_points_xml(table):
+    return (
+        "<DataSet><diffgr:diffgram xmlns:diffgr='urn:schemas-microsoft-com:xml-diffgram-v1'><NewDataSet>"
+        f"<Table>{table}</Table>"
+        "</NewDataSet></diffgr:diffgram></DataSet>"
+    )
+
+
+@pytest.mark.parametrize("table", [
+    "<AtsSerialNum>052194</AtsSerialNum><Latitude>not-a-number</Latitude>"
+    "<DateYearAndJulian>2024-05-31 00:00:00.000</DateYearAndJulian>",
+    "<AtsSerialNum>052194</AtsSerialNum><Latitude>999</Latitude>"
+    "<DateYearAndJulian>2024-05-31 00:00:00.000</DateYearAndJulian>",
+    "<AtsSerialNum>052194</AtsSerialNum><Longitude>-181</Longitude>"
+    "<DateYearAndJulian>2024-05-31 00:00:00.000</DateYearAndJulian>",
+    "<AtsSerialNum /><DateYearAndJulian>2024-05-31 00:00:00.000</DateYearAndJulian>",
+    "<AtsSerialNum>052194</AtsSerialNum><DateYearAndJulian />",
+    "<AtsSerialNum>052194</AtsSerialNum><Mortality>maybe</Mortality>"
+    "<DateYearAndJulian>2024-05-31 00:00:00.000</DateYearAndJulian>",
+])
+@pytest.mark.asyncio
+async def test_parse_data_points_raises_on_invalid_values(table):
+    with pytest.raises(ATSBadXMLException):
+        await parse_data_points_from_xml(_data_points_xml(table))
+
+
+@pytest.mark.asyncio
+async def test_parse_data_points_strips_whitespace():
+    xml = _data_points_xml(
+        "<AtsSerialNum>\n 052194 \n</AtsSerialNum><Latitude> </Latitude><Longitude> -68.52625 </Longitude>"
+        "<DateYearAndJulian>2024-05-31 00:00:00.000</DateYearAndJulian>"
+    )
+    result = await parse_data_points_from_xml(xml)
+    data_point = result["052194"][0]
+    assert data_point.latitude is None
+    assert data_point.longitude == -68.52625
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("true", True), ("Yes", True), ("on", True), ("1", True),
+    ("false", False), ("no", False), ("OFF", False), ("0", False),
+])
+@pytest.mark.asyncio
+async def test_parse_data_points_bool_values(text, expected):
+    xml = _data_points_xml(
+        f"<AtsSerialNum>052194</AtsSerialNum><Mortality>{text}</Mortality>"
+        "<DateYearAndJulian>2024-05-31 00:00:00.000</DateYearAndJulian>"
+    )
+    result = await parse_data_points_from_xml(xml)
+    assert result["052194"][0].mortality is expected
+
+
+@pytest.mark.asyncio
+async def test_parse_data_points_ignores_tables_outside_new_dataset():
+    xml = (
+        "<DataSet><diffgr:diffgram xmlns:diffgr='urn:schemas-microsoft-com:xml-diffgram-v1'>"
+        "<NewDataSet><Table><AtsSerialNum>052194</AtsSerialNum>"
+        "<DateYearAndJulian>2024-05-31 00:00:00.000</DateYearAndJulian></Table></NewDataSet>"
+        "<diffgr:before><Table><AtsSerialNum>052195</AtsSerialNum>"
+        "<DateYearAndJulian>2024-05-30 00:00:00.000</DateYearAndJulian></Table></diffgr:before>"
+        "</diffgr:diffgram></DataSet>"
+    )
+    result = await parse_data_points_from_xml(xml)
+    assert list(result) == ["052194"]
+
+
+@pytest.mark.asyncio
+async def test_parse_data_points_raises_without_dataset():
+    with pytest.raises(ATSBadXMLException):
+        await parse_data_points_from_xml("<NewDataSet><Table><AtsSerialNum>052194</AtsSerialNum></Table></NewDataSet>")
+
+
+def test_closest_transmission(mock_ats_transmissions_parsed):
+    test_date = datetime.datetime(2024, 10, 1, tzinfo=datetime.timezone.utc)
+    result = closest_transmission(mock_ats_transmissions_parsed, test_date)
+    assert result.collar_serial_num == "052191"
+
+
+def test_closest_transmission_prefers_earlier_on_tie(mock_ats_transmissions_parsed):
+    earlier, later = sorted(mock_ats_transmissions_parsed, key=lambda t: t.date_sent)
+    test_date = earlier.date_sent + (later.date_sent - earlier.date_sent) / 2
+    result = closest_transmission(mock_ats_transmissions_parsed, test_date)
+    assert result == earlier
@@ -1,4 +1,3 @@
-from app.actions.ats_client import PullObservationsTransmissionsResponse
 from app.actions.handlers import extract_gmt_offsets
 
 
@@ -1,4 +1,5 @@
 import asyncio
+import datetime
 from unittest import mock
 
 import pytest
@@ -6,7 +7,7 @@ from gundi_core.schemas.v2 import LogLevel
 
 from app.services.action_runner import execute_action
 from .utils import InMemoryIntegrationStateManager
-from ..handlers import PENDING_FILES, PROCESSED_FILES, IN_PROGRESS_FILES
+from ..handlers import PENDING_FILES, PROCESSED_FILES, IN_PROGRESS_FILES, filter_and_transform, generate_batches
 from ...conftest import AsyncMock
 
 
@@ -183,3 +184,117 @@ async def test_process_observations_action_is_thread_safe(
     # Check that the file status is updated
     assert await in_memory_state_manager.group_get(IN_PROGRESS_FILES) == set()
     assert await in_memory_state_manager.group_get(PROCESSED_FILES) == {mock_data_file_name}
+
+
+@pytest.mark.asyncio
+async def test_execute_process_observations_action_sends_batches_concurrently(
+        mocker, mock_gundi_client_v2, mock_state_manager, mock_file_storage, mock_ats_client,
+        mock_get_gundi_api_key, mock_gundi_sensors_client_class, ats_integration_v2, mock_publish_event,
+        mock_gundi_client_v2_class, mock_aiofiles
+):
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.actions.handlers.state_manager", mock_state_manager)
+    mocker.patch("app.actions.handlers.aiofiles", mock_aiofiles)
+    mocker.patch("app.actions.handlers.file_storage", mock_file_storage)
+    mocker.patch("app.actions.handlers.ats_client", mock_ats_client)
+    mocker.patch("app.actions.handlers.settings.OBSERVATIONS_BATCH_SIZE", 1)
+    mocker.patch("app.actions.handlers.settings.MAX_CONCURRENT_OBSERVATION_BATCHES", 2)
+    mocker.patch("app.services.gundi.GundiClient", mock_gundi_client_v2_class)
+    mocker.patch("app.services.gundi.GundiDataSenderClient", mock_gundi_sensors_client_class)
+    mocker.patch("app.services.gundi._get_gundi_api_key", mock_get_gundi_api_key)
+
+    response = await execute_action(
+        integration_id=str(ats_integration_v2.id),
+        action_id="process_observations"
+    )
+
+    # One batch per observation, all of them sent
+    assert response.get("observations_processed") == 3
+    assert mock_gundi_sensors_client_class.return_value.post_observations.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_execute_process_observations_action_cancels_batches_on_error(
+        mocker, mock_gundi_client_v2, mock_state_manager, mock_file_storage, mock_ats_client,
+        mock_get_gundi_api_key, mock_gundi_sensors_client_class, ats_integration_v2, mock_publish_event,
+        mock_gundi_client_v2_class, mock_aiofiles
+):
+    mocker.patch("app.services.action_runner._portal", mock_gundi_client_v2)
+    mocker.patch("app.services.activity_logger.publish_event", mock_publish_event)
+    mocker.patch("app.services.action_runner.publish_event", mock_publish_event)
+    mocker.patch("app.actions.handlers.state_manager", mock_state_manager)
+    mocker.patch("app.actions.handlers.aiofiles", mock_aiofiles)
+    mocker.patch("app.actions.handlers.file_storage", mock_file_storage)
+    mocker.patch("app.actions.handlers.ats_client", mock_ats_client)
+    mocker.patch("app.actions.handlers.settings.OBSERVATIONS_BATCH_SIZE", 1)
+    mocker.patch("app.actions.handlers.settings.MAX_CONCURRENT_OBSERVATION_BATCHES", 1)
+    mocker.patch("app.services.gundi.GundiClient", mock_gundi_client_v2_class)
+    mocker.patch("app.services.gundi.GundiDataSenderClient", mock_gundi_sensors_client_class)
+    mocker.patch("app.services.gundi._get_gundi_api_key", mock_get_gundi_api_key)
+
+    async def post_observations_error(*args, **kwargs):
+        await asyncio.sleep(0)  # Yield control like a real request would
+        raise ValueError("Gundi error")
+
+    mock_gundi_sensors_client_class.return_value.post_observations.side_effect = post_observations_error
+
+    response = await execute_action(
+        integration_id=str(ats_integration_v2.id),
+        action_id="process_observations"
+    )
+
+    # The first batch fails and the ones still waiting for their turn are cancelled
+    assert response.get("observations_processed") == 0
+    assert mock_gundi_sensors_client_class.return_value.post_observations.call_count < 3
+    # The file isn't marked as processed
+    assert not mock_file_storage.delete_file.called
+
+
+@pytest.mark.asyncio
+async def test_filter_and_transform(ats_integration_v2, mock_ats_data_parsed):
+    data_points = mock_ats_data_parsed["052194"]
+
+    observations = await filter_and_transform(
+        "052194", data_points, 3, str(ats_integration_v2.id), "process_observations"
+    )
+
+    assert len(observations) == 2
+    assert observations[0] == {
+        "source": "052194",
+        "source_name": "052194",
+        "type": "tracking-device",
+        "recorded_at": datetime.datetime(
+            2024, 5, 31, 0, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=3))
+        ),
+        "location": {"lat": 5.52827, "lon": -68.52625},
+        "additional": {
+            "num_sats": "08",
+            "hdop": "0.9",
+            "fix_time": "039",
+            "dimension": "3",
+            "activity": "02",
+            "temperature": "+24",
+            "mortality": False,
+            "low_batt_voltage": False
+        }
+    }
+
+
+def test_generate_batches():
+    batches = list(generate_batches(iter(range(5)), 2))
+    assert batches == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.asyncio
+async def test_filter_and_transform_defaults_to_utc(ats_integration_v2, mock_ats_data_parsed):
+    data_points = mock_ats_data_parsed["052191"]
+
+    observations = await filter_and_transform(
+        "052191", data_points, 0, str(ats_integration_v2.id), "process_observations"
+    )
+
+    assert [o["recorded_at"] for o in observations] == [
+        datetime.datetime(2024, 10, 26, 16, 0, tzinfo=datetime.timezone.utc)
+    ]
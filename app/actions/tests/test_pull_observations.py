@@ -1,6 +1,7 @@
+import asyncio
 import pytest
 from app.services.action_runner import execute_action
-from ..handlers import PENDING_FILES
+from ..handlers import PENDING_FILES, gather_or_cancel
 
 
 @pytest.mark.asyncio
@@ -30,10 +31,29 @@ async def test_execute_pull_observations_action(
     assert mock_ats_client.get_transmissions_endpoint_response.called
     assert mock_ats_client.get_data_endpoint_response.called
     # Check that the data is saved as xml files in the cloud
-    assert mock_file_storage.upload_file.call_count == 2
+    assert mock_file_storage.upload_stream.call_count == 2
     assert not mock_gundi_sensors_client_class.return_value.post_observations.called  # No data sent to Gundi
     # Check that the data file is marked as pending for processing
     mock_state_manager.group_add.assert_called_once_with(
         group_name=PENDING_FILES,
         values=[response["data_points_file"]]
     )
+
+
+@pytest.mark.asyncio
+async def test_gather_or_cancel_cancels_pending_tasks_on_failure():
+    slow_task_cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            slow_task_cancelled.set()
+            raise
+
+    async def failing():
+        raise ValueError("ATS is down")
+
+    with pytest.raises(ValueError):
+        await gather_or_cancel(slow(), failing())
+    assert slow_task_cancelled.is_set()
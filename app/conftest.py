@@ -165,6 +165,7 @@ def mock_gcp_cloud_storage_client(
 ):
     mock_client = mocker.MagicMock()
     mock_client.upload_from_filename.return_value = async_return(None)
+    mock_client.upload.return_value = async_return(None)
     mock_client.download_to_filename.return_value = async_return(None)
     mock_client.delete.return_value = async_return(None)
     mock_client.list_objects.return_value = async_return(gcp_bucket_list_response)
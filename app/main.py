@@ -11,6 +11,7 @@ from app.routers import actions, webhooks
 import app.settings as settings
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.actions import ats_client
 from app.services.action_runner import execute_action, _portal
 from app.services.self_registration import register_integration_in_gundi
 
@@ -28,6 +29,7 @@ async def lifespan(app: FastAPI):
     yield
     # Shotdown Hook
     await _portal.close()
+    await ats_client.close()
 
 
 app = FastAPI(
@@ -1,3 +1,5 @@
+import base64
+import hashlib
 import aiohttp
 import stamina
 import asyncio
@@ -30,6 +32,27 @@ class CloudFileStorage:
                     self.bucket_name, target_path, local_file_path, metadata=custom_metadata
                 )
 
+    async def upload_stream(self, integration_id, destination_blob_name, chunks, metadata=None):
+        target_path = self.get_file_fullname(integration_id, destination_blob_name)
+        # Chunks are kept in memory (no local file round-trip). The upload gets bytes, so gcloud-aio-storage
+        # wraps them in a new stream on each attempt (resumable uploads close the stream they are given)
+        parts = []
+        md5 = hashlib.md5()
+        async for chunk in chunks:
+            md5.update(chunk)  # Hashed as it arrives, instead of walking the data again
+            parts.append(chunk)
+        data = b"".join(parts)
+        # GCS checks the object against this hash ("md5-hash" is formatted as "md5Hash" by gcloud-aio-storage)
+        custom_metadata = {"md5-hash": base64.b64encode(md5.digest()).decode("ascii")}
+        if metadata:
+            custom_metadata["metadata"] = metadata
+        for attempt in stamina.retry_context(on=(aiohttp.ClientError, asyncio.TimeoutError),
+                                             attempts=5, wait_initial=1.0, wait_max=30, wait_jitter=3.0):
+            with attempt:
+                await self.storage_client.upload(
+                    self.bucket_name, target_path, data, metadata=custom_metadata
+                )
+
     async def download_file(self, integration_id, source_blob_name, destination_file_path):
         source_path = self.get_file_fullname(integration_id, source_blob_name)
         for attempt in stamina.retry_context(on=(aiohttp.ClientError, asyncio.TimeoutError),
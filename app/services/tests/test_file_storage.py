@@ -1,3 +1,6 @@
+import aiohttp
+import base64
+import hashlib
 import pytest
 
 from app import settings
@@ -29,6 +32,69 @@ async def test_upload_file(mocker, mock_gcp_cloud_storage, integration_v2):
     )
 
 
+@pytest.mark.asyncio
+async def test_upload_stream(mocker, mock_gcp_cloud_storage, integration_v2):
+    mocker.patch("app.services.file_storage.Storage", mock_gcp_cloud_storage)
+    file_storage = CloudFileStorage()
+    integration_id = str(integration_v2.id)
+    blob_name = "202412011002_points_dd65d9de-0ec8-480c-8719-c1f5ff4d639a.xml"
+    metadata = {"ats_account": "marianom"}
+
+    async def chunks():
+        yield b"<DataSet>"
+        yield b"</DataSet>"
+
+    await file_storage.upload_stream(
+        integration_id=integration_id,
+        destination_blob_name=blob_name,
+        chunks=chunks(),
+        metadata=metadata
+    )
+
+    storage_client = mock_gcp_cloud_storage.return_value
+    storage_client.upload.assert_called_once()
+    assert storage_client.upload.call_args.args == (
+        settings.GCP_BUCKET_NAME,
+        f"integrations/{integration_id}/{blob_name}",
+        b"<DataSet></DataSet>"
+    )
+    assert storage_client.upload.call_args.kwargs == {
+        "metadata": {
+            "md5-hash": base64.b64encode(hashlib.md5(b"<DataSet></DataSet>").digest()).decode("ascii"),
+            "metadata": metadata
+        }
+    }
+
+
+@pytest.mark.asyncio
+async def test_upload_stream_retries_on_connection_error(mocker, mock_gcp_cloud_storage, integration_v2):
+    mocker.patch("app.services.file_storage.Storage", mock_gcp_cloud_storage)
+    mocker.patch("time.sleep")  # Skip the backoff between attempts
+    storage_client = mock_gcp_cloud_storage.return_value
+    uploaded = []
+
+    async def upload(bucket_name, target_path, file_data, metadata=None):
+        uploaded.append(file_data)
+        if len(uploaded) == 1:
+            raise aiohttp.ClientConnectionError("Connection reset")
+
+    storage_client.upload.side_effect = upload
+    file_storage = CloudFileStorage()
+
+    async def chunks():
+        yield b"<DataSet>"
+        yield b"</DataSet>"
+
+    await file_storage.upload_stream(
+        integration_id=str(integration_v2.id),
+        destination_blob_name="202412011002_points_dd65d9de-0ec8-480c-8719-c1f5ff4d639a.xml",
+        chunks=chunks()
+    )
+
+    # The whole content is sent again on the retry
+    assert uploaded == [b"<DataSet></DataSet>", b"<DataSet></DataSet>"]
+
+
 @pytest.mark.asyncio
 async def test_download_file(mocker, mock_gcp_cloud_storage, integration_v2):
     mocker.patch("app.services.file_storage.Storage", mock_gcp_cloud_storage)
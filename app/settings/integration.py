@@ -4,3 +4,4 @@ env = Env()
 env.read_env()
 
 OBSERVATIONS_BATCH_SIZE = env.int("OBSERVATIONS_BATCH_SIZE", default=200)
+MAX_CONCURRENT_OBSERVATION_BATCHES = env.int("MAX_CONCURRENT_OBSERVATION_BATCHES", default=8)